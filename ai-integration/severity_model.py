@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""
+Local Severity Model pour Velociraptor AI Integration
+=====================================================
+Modèle local appris sur les verdicts LLM passés (artefact, severity,
+auto_response). Répond en quelques microsecondes et n'envoie au LLM
+configuré que les artefacts sur lesquels il n'est pas assez confiant,
+ainsi que ceux pour lesquels il propose BLOCK ou ISOLATE (confirmation).
+
+- Features: n-grammes hashés (ScriptBlockText, chemins, sources...) en NumPy
+- Modèle: deux régressions logistiques multinomiales (severity, auto_response)
+- Apprentissage incrémental (SGD) à chaque nouveau verdict
+- Calibration prequential: chaque verdict est prédit avant d'être appris,
+  pondérée par la probabilité d'envoi au LLM et persistée avec les verdicts
+- Stockage borné des verdicts: features hashées uniquement, pas d'artefact
+
+Installation:
+    pip install numpy
+
+Utilisation:
+    from severity_model import LearnedSeverityAnalyzer
+    analyzer = LearnedSeverityAnalyzer(GeminiAnalyzer(api_key), confidence=0.9)
+    analysis = analyzer.analyze(artifact)
+    print(analyzer.model.calibration_report())
+
+Author: Help4Info
+"""
+
+import base64
+import collections
+import json
+import os
+import random
+import threading
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from velociraptor_ai_analyzer import AIAnalyzer
+
+# ============================================================
+# FEATURES
+# ============================================================
+
+FEATURE_DIM = 2 ** 16  # indices stockés en uint16 dans le VerdictStore
+FEATURE_VERSION = 1  # à incrémenter si featurize change (features stockées ignorées)
+NGRAM_SIZE = 4
+TEXT_LIMIT = 2000  # caractères par champ pris en compte
+
+SEVERITY_LEVELS = 10
+RESPONSE_ACTIONS = ["NONE", "ALERT", "BLOCK", "ISOLATE"]
+# Actions que le modèle local peut décider seul; BLOCK/ISOLATE sont toujours
+# confirmées par le LLM avant d'atteindre la réponse automatique
+LOCAL_ACTIONS = ("NONE", "ALERT")
+
+# Octets faisant partie d'un token (équivalent de [a-z0-9_$.\-\\/:]+ sur du texte en minuscules)
+_TOKEN_BYTES = np.zeros(256, dtype=bool)
+_TOKEN_BYTES[np.frombuffer(b"abcdefghijklmnopqrstuvwxyz0123456789_$.-\\/:", dtype=np.uint8)] = True
+
+_SKIPPED_FIELDS = frozenset(("client_id", "hostname", "timestamp", "TimeCreated", "hash"))
+_NUMERIC_FIELDS = frozenset(("EventID", "source"))
+
+# Multiplicateurs impairs du hash polynomial (un par position du n-gramme)
+_NGRAM_WEIGHTS = [np.uint64(w) for w in (0x9E3779B1, 0x85EBCA77, 0xC2B2AE3D, 0x27D4EB2F)[:NGRAM_SIZE]]
+_MIX = np.uint64(0xFF51AFD7ED558CCD)
+# Puissances (modulo 2^64) pour le hash polynomial des tokens
+_TOKEN_POWERS = np.cumprod(np.full(TEXT_LIMIT, 0x100000001B3, dtype=np.uint64))
+
+
+def _texts(artifact: Dict) -> Tuple[List[bytes], List[str]]:
+    """Parcours itératif de l'artefact: (noms de champs, textes en minuscules)"""
+    fields, texts = [], []
+    stack = [("", artifact)]
+    while stack:
+        field, value = stack.pop()
+        kind = type(value)
+        if kind is str:
+            if field not in _SKIPPED_FIELDS:
+                fields.append(field.encode("utf-8"))
+                texts.append(value[:TEXT_LIMIT].lower())
+        elif kind is dict:
+            stack.extend(value.items())
+        elif kind is list or kind is tuple:
+            stack.extend((field, item) for item in value)
+        elif (kind is int or kind is float) and field in _NUMERIC_FIELDS:
+            fields.append(field.encode("utf-8"))
+            texts.append(str(value))
+    return fields, texts
+
+
+def _ngram_hashes(octets: np.ndarray) -> np.ndarray:
+    """Hash 32 bits de chaque n-gramme d'octets, entièrement vectorisé
+
+    Équivalent à un hash polynomial sur sliding_window_view(octets, NGRAM_SIZE),
+    calculé par tranches décalées: évite le coût fixe de la vue glissante.
+    """
+    count = len(octets) - NGRAM_SIZE + 1
+    if count <= 0:
+        return np.zeros(0, dtype=np.uint32)
+    mixed = octets[:count] * _NGRAM_WEIGHTS[0]
+    for offset in range(1, NGRAM_SIZE):
+        mixed += octets[offset:offset + count] * _NGRAM_WEIGHTS[offset]  # modulo 2^64
+    return ((mixed * _MIX) >> np.uint64(32)).astype(np.uint32)
+
+
+def _token_hashes(octets: np.ndarray, field_hashes: np.ndarray) -> np.ndarray:
+    """Hash 32 bits de chaque token, préfixé par son champ d'origine, vectorisé"""
+    is_token = _TOKEN_BYTES[octets]
+    positions = np.flatnonzero(is_token)
+    if not positions.size:
+        return np.zeros(0, dtype=np.uint32)
+
+    starts = np.flatnonzero(is_token & ~np.concatenate(([False], is_token[:-1])))
+    token_of = np.searchsorted(starts, positions, side="right") - 1
+    weighted = octets[positions] * _TOKEN_POWERS[positions - starts[token_of]]
+    hashes = np.add.reduceat(weighted, np.searchsorted(positions, starts))
+
+    # Les champs sont séparés par \0: index du champ de chaque token
+    field_of = np.cumsum(octets == 0)[starts]
+    return (((hashes + field_hashes[field_of]) * _MIX) >> np.uint64(32)).astype(np.uint32)
+
+
+def featurize(artifact: Dict) -> Tuple[np.ndarray, np.ndarray]:
+    """Vecteur creux L2-normalisé: (indices, valeurs) de n-grammes et tokens hashés"""
+    fields, texts = _texts(artifact)
+
+    # Un seul passage vectorisé sur tous les champs (séparés par \0)
+    octets = np.frombuffer("\0".join(texts).encode("utf-8"), dtype=np.uint8).astype(np.uint64)
+    field_hashes = np.array([zlib.crc32(field) for field in fields], dtype=np.uint64)
+    raw = np.concatenate([_ngram_hashes(octets), _token_hashes(octets, field_hashes)])
+    if not raw.size:
+        return np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.float32)
+
+    signs = np.where(raw & 0x80000000, -1.0, 1.0).astype(np.float32)
+    idx, inverse = np.unique((raw % FEATURE_DIM).astype(np.int64), return_inverse=True)
+    vals = np.bincount(inverse, weights=signs).astype(np.float32)
+    norm = np.linalg.norm(vals)
+    if norm > 0:
+        vals /= norm
+    return idx, vals
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    exp = np.exp(logits - logits.max())
+    return exp / exp.sum()
+
+
+# ============================================================
+# MODEL
+# ============================================================
+
+class SeverityModel:
+    """Deux têtes softmax (severity 1-10, auto_response) sur features hashées"""
+
+    def __init__(self, learning_rate: float = 0.5, severity_tolerance: int = 1,
+                 calibration_bins: int = 10, history_limit: int = 5000):
+        self.learning_rate = learning_rate
+        self.severity_tolerance = severity_tolerance
+        self.calibration_bins = calibration_bins
+        self.history_limit = history_limit
+        self.w_severity = np.zeros((FEATURE_DIM, SEVERITY_LEVELS), dtype=np.float32)
+        self.b_severity = np.zeros(SEVERITY_LEVELS, dtype=np.float32)
+        self.w_action = np.zeros((FEATURE_DIM, len(RESPONSE_ACTIONS)), dtype=np.float32)
+        self.b_action = np.zeros(len(RESPONSE_ACTIONS), dtype=np.float32)
+        self.samples = 0
+        # (confiance, correct, poids) des prédictions faites avant apprentissage;
+        # poids = 1 / probabilité que l'artefact ait été envoyé au LLM
+        self.history: List[Tuple[float, bool, float]] = []
+        self._lock = threading.Lock()
+
+    def _probabilities(self, idx: np.ndarray, vals: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        p_severity = _softmax(vals @ self.w_severity[idx] + self.b_severity)
+        p_action = _softmax(vals @ self.w_action[idx] + self.b_action)
+        return p_severity, p_action
+
+    def predict(self, artifact: Dict, features: Tuple[np.ndarray, np.ndarray] = None) -> Dict:
+        """Prédit severity/auto_response et une confiance dans [0, 1]"""
+        idx, vals = features or featurize(artifact)
+        p_severity, p_action = self._probabilities(idx, vals)
+
+        severity_index = int(p_severity.argmax())
+        lo = max(0, severity_index - self.severity_tolerance)
+        hi = severity_index + self.severity_tolerance + 1
+        action_index = int(p_action.argmax())
+        confidence = float(min(p_severity[lo:hi].sum(), p_action[action_index]))
+
+        return {
+            "severity": severity_index + 1,
+            "auto_response": RESPONSE_ACTIONS[action_index],
+            "confidence": confidence if self.samples else 0.0
+        }
+
+    def learn(self, artifact: Dict, verdict: Dict, weight: float = 1.0,
+              features: Tuple[np.ndarray, np.ndarray] = None) -> Optional[Dict]:
+        """Apprentissage incrémental d'un verdict LLM; retourne la prédiction préalable
+
+        `weight` corrige le biais d'échantillonnage de la calibration (ex:
+        1 / audit_rate pour un audit); l'entrée d'historique ajoutée est
+        retournée dans prediction["calibration"].
+        """
+        labels = self._labels(verdict)
+        if labels is None:
+            return None
+        severity_index, action_index = labels
+
+        idx, vals = features or featurize(artifact)
+        with self._lock:
+            prediction = self.predict(artifact, (idx, vals))
+            if self.samples:
+                correct = (abs(prediction["severity"] - (severity_index + 1)) <= self.severity_tolerance
+                           and prediction["auto_response"] == RESPONSE_ACTIONS[action_index])
+                prediction["calibration"] = (prediction["confidence"], correct, weight)
+                self.history.append(prediction["calibration"])
+                del self.history[:-self.history_limit]
+
+            self._sgd_step(idx, vals, severity_index, action_index)
+            self.samples += 1
+        return prediction
+
+    def fit(self, pairs: Iterable[Tuple[Dict, Dict]], epochs: int = 3):
+        """Entraîne sur des paires (artefact, verdict)"""
+        self.fit_features(((featurize(artifact), verdict) for artifact, verdict in pairs), epochs)
+
+    def fit_features(self, samples: Iterable[Tuple[Tuple[np.ndarray, np.ndarray], Dict]], epochs: int = 3):
+        """Entraîne sur des paires (features, verdict), ex: VerdictStore.load()"""
+        encoded = []
+        for features, verdict in samples:
+            labels = self._labels(verdict)
+            if labels is not None:
+                encoded.append((features, labels))
+
+        with self._lock:
+            for _ in range(epochs):
+                for (idx, vals), (severity_index, action_index) in encoded:
+                    self._sgd_step(idx, vals, severity_index, action_index)
+            self.samples += len(encoded)
+
+    def restore_history(self, history: Iterable[Tuple[float, bool, float]]):
+        """Recharge l'historique de calibration persisté (VerdictStore.load())"""
+        with self._lock:
+            self.history = [tuple(entry) for entry in history][-self.history_limit:]
+
+    def _sgd_step(self, idx: np.ndarray, vals: np.ndarray, severity_index: int, action_index: int):
+        p_severity, p_action = self._probabilities(idx, vals)
+        p_severity[severity_index] -= 1.0
+        p_action[action_index] -= 1.0
+
+        lr = self.learning_rate
+        self.w_severity[idx] -= lr * np.outer(vals, p_severity)
+        self.b_severity -= lr * p_severity
+        self.w_action[idx] -= lr * np.outer(vals, p_action)
+        self.b_action -= lr * p_action
+
+    @staticmethod
+    def _labels(verdict: Dict) -> Optional[Tuple[int, int]]:
+        try:
+            severity = int(verdict.get("severity"))
+        except (TypeError, ValueError):
+            return None
+        action = str(verdict.get("auto_response", "NONE")).upper()
+        if not 1 <= severity <= SEVERITY_LEVELS or action not in RESPONSE_ACTIONS:
+            return None
+        return severity - 1, RESPONSE_ACTIONS.index(action)
+
+    def calibration_report(self, thresholds: Iterable[float] = (0.5, 0.7, 0.8, 0.9, 0.95)) -> Dict:
+        """Métriques de calibration prequential pour choisir le seuil de confiance
+
+        Seuls les artefacts envoyés au LLM sont évalués (incertains,
+        confirmations, audits): chaque entrée est pondérée par l'inverse de
+        sa probabilité d'envoi, de sorte que les métriques et la couverture
+        estiment le trafic réel et non l'échantillon biaisé.
+        """
+        with self._lock:
+            history = list(self.history)
+        if not history:
+            return {"samples": self.samples, "evaluated": 0}
+
+        confidence = np.array([c for c, _, _ in history], dtype=np.float64)
+        correct = np.array([ok for _, ok, _ in history], dtype=np.float64)
+        weight = np.array([w for _, _, w in history], dtype=np.float64)
+        total = weight.sum()
+
+        def mean(values: np.ndarray, mask: np.ndarray) -> float:
+            return float(np.average(values[mask], weights=weight[mask]))
+
+        bins = np.minimum((confidence * self.calibration_bins).astype(int), self.calibration_bins - 1)
+        reliability = []
+        ece = 0.0
+        for b in range(self.calibration_bins):
+            mask = bins == b
+            if not mask.any():
+                continue
+            gap = abs(mean(confidence, mask) - mean(correct, mask))
+            ece += weight[mask].sum() / total * gap
+            reliability.append({
+                "bin": f"{b / self.calibration_bins:.1f}-{(b + 1) / self.calibration_bins:.1f}",
+                "count": int(mask.sum()),
+                "confidence": round(mean(confidence, mask), 4),
+                "accuracy": round(mean(correct, mask), 4)
+            })
+
+        cutoffs = []
+        for threshold in thresholds:
+            mask = confidence >= threshold
+            cutoffs.append({
+                "threshold": threshold,
+                "coverage": round(float(weight[mask].sum() / total), 4),  # part du trafic au-dessus du seuil
+                "accuracy": round(mean(correct, mask), 4) if mask.any() else None
+            })
+
+        everything = np.ones(len(history), dtype=bool)
+        return {
+            "samples": self.samples,
+            "evaluated": len(history),
+            "accuracy": round(mean(correct, everything), 4),
+            "brier": round(float(np.average((confidence - correct) ** 2, weights=weight)), 4),
+            "ece": round(float(ece), 4),
+            "reliability": reliability,
+            "thresholds": cutoffs
+        }
+
+
+# ============================================================
+# VERDICT STORE
+# ============================================================
+
+class VerdictStore:
+    """Stockage append-only (JSONL) et borné des verdicts LLM
+
+    Seules les features hashées sont écrites, jamais l'artefact (ni
+    ScriptBlockText ni timeline en clair), avec la calibration de la
+    prédiction préalable pour la restaurer au redémarrage. Au-delà de
+    2 x max_records lignes, le fichier est réduit aux max_records
+    plus récentes.
+    """
+
+    def __init__(self, path: str, max_records: int = 10000):
+        self.path = os.path.expanduser(path)
+        self.max_records = max_records
+        self._lock = threading.Lock()
+        self._lines = 0
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                self._lines = sum(1 for _ in f)
+
+    def append(self, features: Tuple[np.ndarray, np.ndarray], verdict: Dict,
+               calibration: Tuple[float, bool, float] = None):
+        idx, vals = features
+        record = {
+            "version": FEATURE_VERSION,
+            "idx": base64.b64encode(idx.astype(np.uint16).tobytes()).decode("ascii"),
+            "vals": base64.b64encode(vals.astype(np.float16).tobytes()).decode("ascii"),
+            "verdict": {
+                "severity": verdict.get("severity"),
+                "auto_response": verdict.get("auto_response")
+            }
+        }
+        if calibration is not None:
+            record["calibration"] = list(calibration)
+
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+            self._lines += 1
+            if self._lines > 2 * self.max_records:
+                self._compact()
+
+    def _compact(self):
+        """Ne garde que les max_records verdicts les plus récents (lock tenu)"""
+        with open(self.path, encoding="utf-8") as f:
+            lines = collections.deque(f, maxlen=self.max_records)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+        os.replace(tmp_path, self.path)
+        self._lines = len(lines)
+
+    def load(self) -> Tuple[List[Tuple[Tuple[np.ndarray, np.ndarray], Dict]], List[Tuple[float, bool, float]]]:
+        """Retourne ([(features, verdict)], historique de calibration)"""
+        if not os.path.exists(self.path):
+            return [], []
+        samples, history = [], []
+        with self._lock, open(self.path, encoding="utf-8") as f:
+            lines = collections.deque(f, maxlen=self.max_records)
+        for line in lines:
+            try:
+                record = json.loads(line)
+                if record.get("version") != FEATURE_VERSION:
+                    continue
+                idx = np.frombuffer(base64.b64decode(record["idx"]), dtype=np.uint16).astype(np.int64)
+                vals = np.frombuffer(base64.b64decode(record["vals"]), dtype=np.float16).astype(np.float32)
+                samples.append(((idx, vals), record["verdict"]))
+                if "calibration" in record:
+                    confidence, correct, weight = record["calibration"]
+                    history.append((float(confidence), bool(correct), float(weight)))
+            except (ValueError, KeyError, TypeError):
+                continue
+        return samples, history
+
+
+# ============================================================
+# ROUTING ANALYZER
+# ============================================================
+
+class LearnedSeverityAnalyzer(AIAnalyzer):
+    """Répond localement si confiant, sinon délègue au LLM et apprend son verdict"""
+
+    def __init__(self, fallback: AIAnalyzer, confidence: float = 0.9, min_samples: int = 50,
+                 store_path: str = None, model: SeverityModel = None, audit_rate: float = 0.05,
+                 store_max_records: int = 10000):
+        self.fallback = fallback
+        self.confidence = confidence
+        self.min_samples = min_samples
+        # Part des verdicts confiants quand même envoyés au LLM, pour que la
+        # calibration ne soit pas mesurée uniquement sur les cas incertains
+        self.audit_rate = audit_rate
+        self.model = model or SeverityModel()
+        self.store = VerdictStore(store_path, store_max_records) if store_path else None
+        self.stats = {"local": 0, "llm": 0, "audit": 0, "confirm": 0}
+
+        if self.store:
+            samples, history = self.store.load()
+            self.model.fit_features(samples)
+            self.model.restore_history(history)
+
+    def analyze(self, data: Dict) -> Dict:
+        features = featurize(data)
+        if self.model.samples >= self.min_samples:
+            prediction = self.model.predict(data, features)
+            if prediction["confidence"] >= self.confidence:
+                if prediction["auto_response"] not in LOCAL_ACTIONS:
+                    self.stats["confirm"] += 1
+                    return self._ask_llm(data, features)
+                if random.random() < self.audit_rate:
+                    # Un seul cas sur 1/audit_rate est observé: poids correspondant
+                    self.stats["audit"] += 1
+                    return self._ask_llm(data, features, weight=1 / self.audit_rate)
+                self.stats["local"] += 1
+                return {
+                    "severity": prediction["severity"],
+                    "auto_response": prediction["auto_response"],
+                    "summary": "Local model verdict (high confidence)",
+                    "confidence": round(prediction["confidence"] * 100),
+                    "mitre_techniques": [],
+                    "iocs": [],
+                    "recommendations": [],
+                    "model": "local"
+                }
+
+        self.stats["llm"] += 1
+        return self._ask_llm(data, features)
+
+    def _ask_llm(self, data: Dict, features: Tuple[np.ndarray, np.ndarray], weight: float = 1.0) -> Dict:
+        analysis = self.fallback.analyze(data)
+        if "error" in analysis:
+            return analysis
+        prediction = self.model.learn(data, analysis, weight, features)
+        if prediction is not None and self.store:
+            self.store.append(features, analysis, prediction.get("calibration"))
+        return analysis
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+Shard Dispatcher pour Velociraptor AI Integration
+=================================================
+Répartit les événements sur N processus workers par affinité client:
+chaque `client_id` est placé sur un anneau de hachage cohérent, de sorte
+que tous les événements d'un même endpoint sont traités par le même
+worker (état local, dédoublonnage, caches) tout en utilisant tous les
+cœurs de la machine.
+
+Chaque worker exécute ses jobs sur un pool de threads (les handlers sont
+des appels HTTP bloquants): plusieurs jobs, y compris d'un même client,
+peuvent s'exécuter en parallèle et partager son état. Les jobs sans
+client_id sont répartis en tourniquet.
+
+Utilisation:
+    from shard_dispatcher import ShardedDispatcher
+
+    def handler(client_id, payload, state):
+        state["events"] = state.get("events", 0) + 1
+        return {"client_id": client_id, "events": state["events"]}
+
+    dispatcher = ShardedDispatcher(handler, workers=4, threads=16)
+    dispatcher.start()
+    result = dispatcher.submit("C.54b3f7d051fbbebd", {"data": {}}).result()
+    dispatcher.resize(8)
+    dispatcher.stop()
+
+Author: Help4Info
+"""
+
+import bisect
+import collections
+import hashlib
+import itertools
+import multiprocessing
+import pickle
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+# ============================================================
+# CONSISTENT HASH RING
+# ============================================================
+
+DEFAULT_VIRTUAL_NODES = 64
+
+
+def _hash(key: str) -> int:
+    """Hash 64 bits stable entre processus (contrairement à hash())"""
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Anneau de hachage cohérent avec nœuds virtuels"""
+
+    def __init__(self, workers: int, virtual_nodes: int = DEFAULT_VIRTUAL_NODES):
+        if workers < 1:
+            raise ValueError(f"workers must be >= 1, got {workers}")
+        self.workers = workers
+        self.virtual_nodes = virtual_nodes
+        self._keys: List[int] = []
+        self._owners: List[int] = []
+        self._build()
+
+    def _build(self):
+        points = sorted(
+            (_hash(f"worker-{worker}#{replica}"), worker)
+            for worker in range(self.workers)
+            for replica in range(self.virtual_nodes)
+        )
+        self._keys = [point for point, _ in points]
+        self._owners = [worker for _, worker in points]
+
+    def get_worker(self, client_id: str) -> int:
+        """Retourne l'index du worker propriétaire de ce client"""
+        index = bisect.bisect(self._keys, _hash(client_id)) % len(self._keys)
+        return self._owners[index]
+
+    def resize(self, workers: int) -> "HashRing":
+        """Retourne un nouvel anneau; seuls ~1/N des clients changent de worker"""
+        return HashRing(workers, self.virtual_nodes)
+
+
+# ============================================================
+# WORKER PROCESS
+# ============================================================
+
+_STOP = None  # Sentinelle de fin pour la file d'un worker
+_LIVENESS_INTERVAL = 0.5  # secondes entre deux vérifications des workers
+DEFAULT_WORKER_THREADS = 16
+_MAX_CLIENT_STATES = 10000  # états clients conservés par worker (LRU)
+
+
+def _worker_loop(worker_id: int, handler: Callable, inbox, outbox, threads: int):
+    """Boucle d'un worker: jobs exécutés sur un pool de threads
+
+    L'état d'un client est partagé par ses jobs concurrents: le handler doit
+    protéger ses lectures/écritures (verrou court, pas pendant l'appel LLM).
+    """
+    client_state: "collections.OrderedDict[str, Dict]" = collections.OrderedDict()
+    lock = threading.Lock()
+    pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix=f"shard-{worker_id}")
+
+    def run(request_id: int, client_id: Optional[str], payload: Any):
+        state: Dict = {}
+        if client_id:
+            with lock:
+                state = client_state.setdefault(client_id, {})
+                client_state.move_to_end(client_id)
+                if len(client_state) > _MAX_CLIENT_STATES:
+                    client_state.popitem(last=False)
+        try:
+            # Sérialisé ici: une erreur de pickle revient comme une erreur,
+            # au lieu d'être perdue par le thread d'envoi de la Queue
+            result = pickle.dumps(handler(client_id, payload, state))
+            outbox.put((request_id, worker_id, True, result))
+        except Exception as e:
+            outbox.put((request_id, worker_id, False, f"{e}\n{traceback.format_exc()}"))
+
+    while True:
+        job = inbox.get()
+        if job is _STOP:
+            break
+        pool.submit(run, *job)
+
+    pool.shutdown(wait=True)
+
+
+# ============================================================
+# DISPATCHER
+# ============================================================
+
+class ShardedDispatcher:
+    """Dispatcher léger: route chaque client vers son worker par hachage cohérent
+
+    Les workers sont créés via forkserver (ou spawn): un fork depuis un
+    thread de requête Flask pourrait hériter d'un verrou tenu par un autre
+    thread et bloquer le worker.
+    """
+
+    def __init__(self, handler: Callable[[str, Any, Dict], Any], workers: int = None,
+                 virtual_nodes: int = DEFAULT_VIRTUAL_NODES, threads: int = DEFAULT_WORKER_THREADS):
+        # handler doit être une fonction de niveau module (picklable)
+        self.handler = handler
+        self.threads = threads
+        self.ring = HashRing(workers or multiprocessing.cpu_count(), virtual_nodes)
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self._ctx = multiprocessing.get_context(method)
+        self._outbox = self._ctx.Queue()
+        self._inboxes: List = []
+        self._processes: List = []
+        self._pending: Dict[int, Future] = {}
+        self._owner: Dict[int, int] = {}  # request_id -> worker_id
+        self._routed: Dict[int, int] = {}
+        self._restarts = 0
+        self._ids = itertools.count()
+        self._spread = itertools.count()  # tourniquet des jobs sans client_id
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._gate_closed = False  # soumissions suspendues (resize/stop)
+        self._collector: Optional[threading.Thread] = None
+        self._running = False
+
+    @property
+    def workers(self) -> int:
+        return self.ring.workers
+
+    def start(self):
+        """Démarre les workers et le thread de collecte des résultats"""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            self._spawn_until(self.ring.workers)
+
+        self._collector = threading.Thread(target=self._collect, name="shard-collector", daemon=True)
+        self._collector.start()
+
+    def _new_worker(self, worker_id: int):
+        inbox = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=_worker_loop,
+            args=(worker_id, self.handler, inbox, self._outbox, self.threads),
+            name=f"shard-worker-{worker_id}",
+            daemon=True
+        )
+        process.start()
+        return inbox, process
+
+    def _spawn_until(self, count: int):
+        while len(self._processes) < count:
+            inbox, process = self._new_worker(len(self._processes))
+            self._inboxes.append(inbox)
+            self._processes.append(process)
+
+    def _stop_from(self, count: int):
+        while len(self._processes) > count:
+            inbox = self._inboxes.pop()
+            process = self._processes.pop()
+            inbox.put(_STOP)
+            process.join()
+
+    def submit(self, client_id: str, payload: Any) -> Future:
+        """Envoie un événement au worker propriétaire du client
+
+        Sans client_id, l'événement n'a pas d'affinité: il est réparti en
+        tourniquet et reçoit un état vide.
+        """
+        future: Future = Future()
+
+        with self._lock:
+            while self._gate_closed:
+                self._idle.wait()
+            if not self._running:
+                raise RuntimeError("Dispatcher not started")
+            if client_id:
+                worker_id = self.ring.get_worker(client_id)
+            else:
+                worker_id = next(self._spread) % self.ring.workers
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+            self._owner[request_id] = worker_id
+            self._routed[worker_id] = self._routed.get(worker_id, 0) + 1
+            self._inboxes[worker_id].put((request_id, client_id, payload))
+
+        return future
+
+    def _resolve(self, request_id: int) -> Optional[Future]:
+        """Retire la requête des attentes (lock tenu) et retourne son Future"""
+        future = self._pending.pop(request_id, None)
+        self._owner.pop(request_id, None)
+        if not self._pending:
+            self._idle.notify_all()
+        return future
+
+    def _collect(self):
+        last_check = time.monotonic()
+        while True:
+            # Vérification périodique, même sous charge continue
+            if time.monotonic() - last_check >= _LIVENESS_INTERVAL:
+                self._check_workers()
+                last_check = time.monotonic()
+            try:
+                message = self._outbox.get(timeout=_LIVENESS_INTERVAL)
+            except queue.Empty:
+                continue
+            if message is _STOP:
+                break
+
+            request_id, _, ok, result = message
+            with self._lock:
+                future = self._resolve(request_id)
+            if future is None:
+                continue
+            if ok:
+                try:
+                    future.set_result(pickle.loads(result))
+                except Exception as e:
+                    future.set_exception(RuntimeError(f"Cannot unpickle result: {e}"))
+            else:
+                future.set_exception(RuntimeError(result))
+
+    def _check_workers(self):
+        """Remplace les workers morts (OOM, segfault) et échoue leurs requêtes"""
+        failed = []
+        with self._lock:
+            for worker_id, process in enumerate(self._processes):
+                if process.is_alive():
+                    continue
+                lost = [rid for rid, owner in self._owner.items() if owner == worker_id]
+                failed += [(self._resolve(rid), process.exitcode) for rid in lost]
+                # Nouvelle file: les jobs restant dans l'ancienne sont déjà échoués
+                self._inboxes[worker_id], self._processes[worker_id] = self._new_worker(worker_id)
+                self._restarts += 1
+
+        for future, exitcode in failed:
+            if future is not None:
+                future.set_exception(RuntimeError(f"Shard worker died (exit code {exitcode})"))
+
+    def _drain(self):
+        """Ferme la porte aux soumissions puis attend les événements en cours (lock tenu)"""
+        while self._gate_closed:
+            self._idle.wait()
+        self._gate_closed = True
+        while self._pending:
+            self._idle.wait()
+
+    def _reopen(self):
+        self._gate_closed = False
+        self._idle.notify_all()
+
+    def resize(self, workers: int):
+        """Change le nombre de workers et rééquilibre l'anneau
+
+        Les nouvelles soumissions attendent et les événements en cours sont
+        drainés avant la bascule, afin qu'un client déplacé ne soit jamais
+        traité en parallèle par l'ancien et le nouveau worker. L'état local
+        des clients déplacés repart de zéro sur leur nouveau worker.
+        """
+        with self._lock:
+            if workers == self.ring.workers:
+                return
+            self._drain()
+            try:
+                self.ring = self.ring.resize(workers)
+                if self._running:
+                    self._spawn_until(workers)
+                    self._stop_from(workers)
+            finally:
+                self._reopen()
+
+    def stop(self):
+        """Arrête les workers après traitement des événements en attente"""
+        with self._lock:
+            if not self._running:
+                return
+            self._drain()
+            try:
+                self._running = False
+                self._stop_from(0)
+            finally:
+                self._reopen()
+
+        self._outbox.put(_STOP)
+        if self._collector:
+            self._collector.join()
+
+    def stats(self) -> Dict:
+        """Statistiques de répartition par worker"""
+        with self._lock:
+            return {
+                "workers": self.ring.workers,
+                "threads": self.threads,
+                "running": self._running,
+                "pending": len(self._pending),
+                "restarts": self._restarts,
+                "shards": [
+                    {
+                        "worker": worker_id,
+                        "pid": process.pid,
+                        "alive": process.is_alive(),
+                        "pending": sum(1 for owner in self._owner.values() if owner == worker_id),
+                        "routed": self._routed.get(worker_id, 0)
+                    }
+                    for worker_id, process in enumerate(self._processes)
+                ]
+            }
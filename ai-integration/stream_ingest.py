@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Streaming Ingestion pour Velociraptor AI Integration
+====================================================
+Lecture incrémentale des corps de requête du webhook server, sans jamais
+charger le payload complet en mémoire:
+
+- Décompression à la volée: gzip, zstd (optionnel: pip install zstandard)
+- Formats: JSON (objet ou tableau) et NDJSON / JSON Lines
+- Flux de lignes: les tableaux d'un objet JSON de premier niveau
+  (ex: {"hostname": ..., "powershell_logs": [...]}) sont émis ligne par
+  ligne, les autres membres sont regroupés dans un en-tête
+- Limites configurables: taille brute, taille décompressée, taille d'une ligne
+- Aperçu borné pour les logs, sans sérialiser tout l'objet
+
+Utilisation:
+    parser = RowStreamParser(decoded_chunks(request.stream, "gzip", max_bytes=...))
+    for field, row in parser.rows():
+        ...
+    print(parser.header)
+
+Author: Help4Info
+"""
+
+import codecs
+import gzip
+import json
+import zlib
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # zstd optionnel
+    zstandard = None
+
+CHUNK_SIZE = 64 * 1024
+
+_DECODE_ERRORS = (OSError, EOFError, zlib.error) + ((zstandard.ZstdError,) if zstandard else ())
+
+# Caractères pouvant suivre un nombre JSON complet
+_NUMBER_END = " \t\r\n,]}"
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl",
+                "application/x-jsonlines", "application/json-seq")
+
+
+class PayloadTooLarge(Exception):
+    """Le corps dépasse une des limites configurées"""
+
+
+class UnsupportedEncoding(Exception):
+    """Content-Encoding non supporté (ou zstandard non installé)"""
+
+
+# ============================================================
+# DECOMPRESSION
+# ============================================================
+
+class _CappedReader:
+    """Lecture brute bornée, avec copie optionnelle (tee) pour la capture"""
+
+    def __init__(self, stream, max_bytes: int, tee=None):
+        self.stream = stream
+        self.max_bytes = max_bytes
+        self.tee = tee
+        self.bytes_read = 0
+
+    def read(self, size: int = CHUNK_SIZE) -> bytes:
+        if size is None or size < 0:
+            size = CHUNK_SIZE
+        data = self.stream.read(size)
+        self.bytes_read += len(data)
+        if self.bytes_read > self.max_bytes:
+            raise PayloadTooLarge(f"Request body exceeds {self.max_bytes} bytes")
+        if self.tee is not None:
+            self.tee.write(data)
+        return data
+
+    def readable(self) -> bool:
+        return True
+
+
+def decoded_chunks(stream, content_encoding: Optional[str], max_bytes: int,
+                   max_decoded_bytes: int = None, tee=None) -> Iterator[bytes]:
+    """Flux d'octets décompressés, par blocs de CHUNK_SIZE, avec limites"""
+    raw = _CappedReader(stream, max_bytes, tee)
+    encoding = (content_encoding or "identity").strip().lower()
+
+    if encoding == "identity":
+        reader = raw
+    elif encoding in ("gzip", "x-gzip"):
+        reader = gzip.GzipFile(fileobj=raw, mode="rb")
+    elif encoding == "zstd":
+        if zstandard is None:
+            raise UnsupportedEncoding("zstd requires: pip install zstandard")
+        # Plusieurs frames sont valides (RFC 8878, pzstd): toutes les lire
+        reader = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+    else:
+        raise UnsupportedEncoding(f"Unsupported Content-Encoding: {content_encoding}")
+
+    max_decoded_bytes = max_decoded_bytes or max_bytes
+    decoded = 0
+    try:
+        while True:
+            chunk = reader.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            decoded += len(chunk)
+            if decoded > max_decoded_bytes:
+                raise PayloadTooLarge(f"Decoded body exceeds {max_decoded_bytes} bytes")
+            yield chunk
+    except _DECODE_ERRORS as e:
+        raise ValueError(f"Invalid {encoding} body: {e}")
+
+    # Des octets après la fin du flux compressé seraient des lignes perdues
+    if raw.read(CHUNK_SIZE):
+        raise ValueError(f"Invalid {encoding} body: trailing data after compressed stream")
+    if tee is not None:
+        tee.complete = True
+
+
+def is_ndjson(content_type: Optional[str]) -> bool:
+    return (content_type or "").split(";")[0].strip().lower() in NDJSON_TYPES
+
+
+# ============================================================
+# INCREMENTAL JSON PARSER
+# ============================================================
+
+class RowStreamParser:
+    """Parse un flux JSON/NDJSON en lignes (field, row) à mémoire bornée
+
+    - Tableau de premier niveau ou NDJSON: chaque élément -> (None, row)
+    - Objet de premier niveau (si split_object): chaque élément d'un membre
+      tableau -> (clé, row); les autres membres vont dans self.header
+    """
+
+    def __init__(self, chunks: Iterator[bytes], max_row_bytes: int = 1024 * 1024,
+                 split_object: bool = True):
+        self.chunks = iter(chunks)
+        self.max_row_bytes = max_row_bytes
+        self.split_object = split_object
+        self.header: Dict[str, Any] = {}
+        self.row_size = 0  # taille JSON (caractères) de la dernière valeur lue
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    # --- Buffer ---
+
+    def _fill(self) -> bool:
+        """Ajoute un bloc au buffer; False si le flux est terminé"""
+        if self._eof:
+            return False
+        if self._pos > len(self._buf) // 2:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+        try:
+            chunk = next(self.chunks)
+            self._buf += self._utf8.decode(chunk)
+        except StopIteration:
+            self._buf += self._utf8.decode(b"", final=True)
+            self._eof = True
+        return True
+
+    def _peek(self) -> str:
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in " \t\r\n\ufeff":
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ""
+
+    def _expect(self, chars: str) -> str:
+        c = self._peek()
+        if not c or c not in chars:
+            raise ValueError(f"Invalid JSON: expected one of {chars!r}, got {c!r}")
+        self._pos += 1
+        return c
+
+    def _value(self) -> Any:
+        """Décode une valeur JSON complète, en lisant plus de données si besoin"""
+        self._peek()
+        while True:
+            pending = len(self._buf) - self._pos
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+                # Un nombre coupé par la fin du buffer ("10." -> 10) n'est
+                # complet que s'il est suivi d'un délimiteur
+                complete = end < len(self._buf) and (
+                    type(value) not in (int, float) or self._buf[end] in _NUMBER_END)
+                if complete or self._eof:
+                    self.row_size = end - self._pos
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self._eof:
+                    raise ValueError(f"Invalid JSON: {e}")
+            if pending > self.max_row_bytes:
+                raise PayloadTooLarge(f"JSON row exceeds {self.max_row_bytes} bytes")
+            # Lire jusqu'à doubler la partie en attente: coût de re-parsing amorti
+            while len(self._buf) - self._pos < 2 * pending + 1 and self._fill():
+                pass
+
+    # --- Structure ---
+
+    def _array(self, field: Optional[str]) -> Iterator[Tuple[Optional[str], Any]]:
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield field, self._value()
+            if self._expect(",]") == "]":
+                return
+
+    def _object(self) -> Iterator[Tuple[Optional[str], Any]]:
+        if self._peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self._value()
+            if not isinstance(key, str):
+                raise ValueError("Invalid JSON: object key must be a string")
+            self._expect(":")
+            if self._peek() == "[":
+                self._pos += 1
+                yield from self._array(key)
+            else:
+                self.header[key] = self._value()
+            if self._expect(",}") == "}":
+                return
+
+    def rows(self) -> Iterator[Tuple[Optional[str], Any]]:
+        """Itère sur les lignes du flux"""
+        first = True
+        while True:
+            c = self._peek()
+            if not c:
+                return
+            if c == "[":
+                self._pos += 1
+                yield from self._array(None)
+            elif c == "{" and self.split_object and first:
+                self._pos += 1
+                yield from self._object()
+            else:
+                yield None, self._value()
+            first = False
+
+
+def read_document(chunks: Iterator[bytes], max_bytes: int) -> Any:
+    """Lit un unique document JSON (borné) depuis un flux décompressé"""
+    parser = RowStreamParser(chunks, max_row_bytes=max_bytes, split_object=False)
+    if not parser._peek():
+        raise ValueError("Invalid JSON: empty body")
+    document = parser._value()
+    if parser._peek():
+        raise ValueError("Invalid JSON: trailing data after document")
+    return document
+
+
+# ============================================================
+# LOG PREVIEW
+# ============================================================
+
+_PREVIEW_ENCODER = json.JSONEncoder(indent=2, default=str, ensure_ascii=False)
+
+
+def preview_json(value: Any, limit: int = 500) -> str:
+    """Aperçu des `limit` premiers caractères, sérialisés paresseusement"""
+    parts = []
+    size = 0
+    for part in _PREVIEW_ENCODER.iterencode(value):
+        parts.append(part)
+        size += len(part)
+        if size >= limit:
+            break
+    return "".join(parts)[:limit]
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Tests du parseur streaming (stream_ingest.py)
+
+Lancement:
+    python -m pytest -q test_stream_ingest.py
+    python -m unittest test_stream_ingest
+
+Author: Help4Info
+"""
+
+import gzip
+import io
+import json
+import unittest
+
+from stream_ingest import RowStreamParser, decoded_chunks, read_document
+
+try:
+    import zstandard
+except ImportError:  # zstd optionnel
+    zstandard = None
+
+DOCUMENTS = [
+    b'[10.25]',
+    b'[-2.5e10]',
+    b'[0, 1.5]',
+    b'[true, null, 1E+2, "x", {"a": [1, 2.0]}]',
+    b'{"hostname": "WS01", "cpu_total": 10.25, "powershell_logs": [{"EventID": 4104}, -0.5e-3]}',
+    b'{"powershell_logs": [1, 2], "cpu_total": 7, "client_id": "C.1"}',
+    b'{"empty": [], "nested": {"v": 3.25}}',
+]
+
+NDJSON = b'{"EventID": 4104, "t": 1.5}\n2e3\n-0\n{"EventID": 1}\n'
+
+
+def chunked(data: bytes, size: int):
+    return (data[i:i + size] for i in range(0, len(data), size))
+
+
+def parse_rows(data: bytes, size: int, split_object: bool = True):
+    parser = RowStreamParser(chunked(data, size), split_object=split_object)
+    return list(parser.rows()), parser.header
+
+
+def expected_rows(document):
+    """Lignes et en-tête attendus, calculés avec json.loads"""
+    if isinstance(document, list):
+        return [(None, row) for row in document], {}
+    rows = [(key, row) for key, value in document.items() if isinstance(value, list) for row in value]
+    header = {key: value for key, value in document.items() if not isinstance(value, list)}
+    return rows, header
+
+
+class ChunkBoundaryTest(unittest.TestCase):
+    """Chaque document doit être lu à l'identique quelle que soit la taille des blocs"""
+
+    def test_rows_every_chunk_size(self):
+        for data in DOCUMENTS:
+            expected = expected_rows(json.loads(data))
+            for size in range(1, len(data) + 1):
+                with self.subTest(document=data, chunk_size=size):
+                    self.assertEqual(parse_rows(data, size), expected)
+
+    def test_ndjson_every_chunk_size(self):
+        expected = [(None, json.loads(line)) for line in NDJSON.splitlines()]
+        for size in range(1, len(NDJSON) + 1):
+            with self.subTest(chunk_size=size):
+                self.assertEqual(parse_rows(NDJSON, size, split_object=False)[0], expected)
+
+    def test_read_document_every_chunk_size(self):
+        for data in DOCUMENTS:
+            for size in range(1, len(data) + 1):
+                with self.subTest(document=data, chunk_size=size):
+                    self.assertEqual(read_document(chunked(data, size), len(data)), json.loads(data))
+
+    def test_read_document_rejects_empty_and_trailing(self):
+        for data in (b"", b"  ", b"[1] 2", b"{} x"):
+            with self.subTest(document=data):
+                with self.assertRaises(ValueError):
+                    read_document(chunked(data, 1), 100)
+
+
+class DecompressionTest(unittest.TestCase):
+
+    def decode(self, body: bytes, encoding: str) -> bytes:
+        return b"".join(decoded_chunks(io.BytesIO(body), encoding, max_bytes=len(body)))
+
+    def test_gzip_multi_member(self):
+        body = gzip.compress(b"[1, ") + gzip.compress(b"2]")
+        self.assertEqual(self.decode(body, "gzip"), b"[1, 2]")
+
+    def test_gzip_trailing_data_rejected(self):
+        with self.assertRaises(ValueError):
+            self.decode(gzip.compress(b"[1]") + b"garbage", "gzip")
+
+    @unittest.skipUnless(zstandard, "pip install zstandard")
+    def test_zstd_multi_frame(self):
+        compressor = zstandard.ZstdCompressor()
+        body = compressor.compress(b"[1, ") + compressor.compress(b"2]")
+        self.assertEqual(self.decode(body, "zstd"), b"[1, 2]")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+Traffic Record & Replay pour Velociraptor AI Integration
+========================================================
+Enregistre le trafic réel du webhook server (/webhook/velociraptor et
+/analyze) dans un journal JSONL compressé, puis le rejoue avec le timing
+d'origine (1x, Nx ou vitesse max) contre un serveur utilisant les
+fournisseurs AI stubs, pour mesurer l'effet de chaque optimisation.
+
+Capture (côté serveur):
+    CAPTURE_FILE=capture.jsonl.gz CAPTURE_REDACT=password,ScriptBlockText \\
+        python webhook_server.py
+
+Serveur cible pour le replay:
+    AI_PROVIDER_STUB=1 STUB_LATENCY_MS=200 python webhook_server.py
+
+Replay:
+    python traffic_replay.py capture.jsonl.gz --target http://localhost:5000 --speed 10
+    python traffic_replay.py capture.jsonl.gz --speed max --concurrency 64 --json
+
+Author: Help4Info
+"""
+
+import argparse
+import base64
+import gzip
+import hashlib
+import hmac
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from stream_ingest import PayloadTooLarge, RowStreamParser, UnsupportedEncoding, decoded_chunks, is_ndjson
+
+CAPTURED_PATHS = ("/webhook/velociraptor", "/analyze")
+REDACTED = "[REDACTED:{}]"
+CAPTURE_MAX_BYTES = 16 * 1024 * 1024  # au-delà, la requête n'est pas capturée
+
+# ============================================================
+# RECORDER
+# ============================================================
+
+def redact(value, keys: Iterable[str], secret: bytes):
+    """Remplace les valeurs des clés sensibles par un HMAC court
+
+    Avec la même clé secrète, deux valeurs identiques restent identiques
+    (cardinalité conservée pour les caches/dedup du replay); la clé
+    aléatoire empêche de retrouver les valeurs par dictionnaire.
+    """
+    keys = {k.lower() for k in keys}
+    if not keys:
+        return value
+
+    def mask(v) -> str:
+        digest = hmac.new(secret, json.dumps(v, default=str).encode("utf-8"), hashlib.sha256)
+        return REDACTED.format(digest.hexdigest()[:12])
+
+    def walk(item):
+        if isinstance(item, dict):
+            return {k: mask(v) if k.lower() in keys else walk(v) for k, v in item.items()}
+        if isinstance(item, list):
+            return [walk(v) for v in item]
+        return item
+
+    return walk(value)
+
+
+class CaptureBuffer:
+    """Copie (tee) du corps brut pendant sa lecture en streaming, sur disque si gros"""
+
+    def __init__(self, path: str, content_type: str, content_encoding: str, max_bytes: int):
+        self.ts = time.time()  # arrivée de la requête, pour le timing du replay
+        self.path = path
+        self.content_type = content_type
+        self.content_encoding = content_encoding
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.truncated = False
+        self.complete = False  # positionné par stream_ingest en fin de flux
+        self._file = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+
+    def write(self, data: bytes):
+        if self.truncated:
+            return
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.truncated = True
+            self._file.close()
+            return
+        self._file.write(data)
+
+    def read_all(self) -> bytes:
+        self._file.seek(0)
+        return self._file.read()
+
+    def close(self):
+        self._file.close()
+
+
+class TrafficRecorder:
+    """Journal append-only JSONL gzip des requêtes reçues (thread-safe)"""
+
+    def __init__(self, path: str, redact_keys: Iterable[str] = (), max_bytes: int = CAPTURE_MAX_BYTES):
+        self.path = path
+        self.redact_keys = [k.strip() for k in redact_keys if k.strip()]
+        # Clé HMAC propre à cette capture, jamais écrite sur disque
+        self._secret = os.urandom(32)
+        self.max_bytes = max_bytes
+        self.records = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+        # Chaque requête est écrite comme un membre gzip complet: le journal
+        # reste lisible si le serveur est tué, et une nouvelle session peut
+        # y ajouter ses membres après un redémarrage
+        self._file = open(path, "ab")
+
+    def begin(self, path: str, content_type: str = "application/json",
+              content_encoding: str = None) -> CaptureBuffer:
+        """Prépare la copie d'un corps lu en streaming (voir stream_ingest)"""
+        return CaptureBuffer(path, content_type, content_encoding, self.max_bytes)
+
+    def finish(self, capture: CaptureBuffer):
+        """Enregistre la requête si son corps a été lu en entier sous la limite"""
+        try:
+            if capture.complete and not capture.truncated:
+                self.record(capture.path, capture.read_all(), capture.content_type,
+                            capture.content_encoding, ts=capture.ts)
+            else:
+                with self._lock:
+                    self.skipped += 1
+        finally:
+            capture.close()
+
+    def record(self, path: str, body: bytes, content_type: str = "application/json",
+               content_encoding: str = None, ts: float = None):
+        entry = {"ts": ts or time.time(), "path": path, "content_type": content_type}
+
+        try:
+            if self.redact_keys:
+                # Décodage nécessaire pour masquer: rejoué ensuite non compressé
+                chunks = decoded_chunks(io.BytesIO(body), content_encoding, len(body) + 1, self.max_bytes)
+                if is_ndjson(content_type):
+                    parser = RowStreamParser(chunks, max_row_bytes=self.max_bytes, split_object=False)
+                    entry["body_rows"] = [redact(row, self.redact_keys, self._secret) for _, row in parser.rows()]
+                else:
+                    entry["body"] = redact(json.loads(b"".join(chunks)), self.redact_keys, self._secret)
+            elif not content_encoding and not is_ndjson(content_type) and "json" in (content_type or ""):
+                entry["body"] = json.loads(body)
+            else:
+                # Corps compressé ou NDJSON: conservé tel quel pour un replay fidèle
+                entry["content_encoding"] = content_encoding
+                entry["body_b64"] = base64.b64encode(body).decode("ascii")
+        except (ValueError, PayloadTooLarge, UnsupportedEncoding):
+            if self.redact_keys:
+                # Impossible de masquer un corps invalide: non enregistré
+                with self._lock:
+                    self.skipped += 1
+                return
+            entry["content_encoding"] = content_encoding
+            entry["body_b64"] = base64.b64encode(body).decode("ascii")
+
+        member = gzip.compress((json.dumps(entry, default=str) + "\n").encode("utf-8"))
+        with self._lock:
+            if self._file.closed:  # arrêt du serveur en cours
+                self.skipped += 1
+                return
+            self._file.write(member)
+            self._file.flush()
+            self.records += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+_GZIP_MAGIC = b"\x1f\x8b\x08"
+_READ_SIZE = 1024 * 1024
+
+
+def _gzip_members(f) -> Iterator[bytes]:
+    """Décompresse un fichier gzip membre par membre
+
+    Un membre tronqué (serveur tué pendant l'écriture) ou corrompu est
+    abandonné et la lecture reprend au prochain en-tête gzip: les sessions
+    ajoutées après un redémarrage restent lisibles.
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    output: List[bytes] = []
+    data = f.read(_READ_SIZE)
+    while data:
+        try:
+            output.append(decompressor.decompress(data))
+        except zlib.error:
+            # Resynchronisation sur le prochain en-tête (le membre courant est perdu)
+            output = []
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            start = data.find(_GZIP_MAGIC, 1)
+            while start == -1:
+                more = f.read(_READ_SIZE)
+                if not more:
+                    return
+                data = data[-2:] + more
+                start = data.find(_GZIP_MAGIC, 1)
+            data = data[start:]
+            continue
+
+        if decompressor.eof:
+            yield b"".join(output)
+            output = []
+            data = decompressor.unused_data
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            data = f.read(_READ_SIZE)
+
+
+def load_capture(path: str) -> Iterator[Dict]:
+    """Lit un journal de capture (gzip ou texte brut)
+
+    Les lignes illisibles (membre tronqué ou corrompu) sont ignorées.
+    """
+    with open(path, "rb") as f:
+        if path.endswith(".gz"):
+            lines = (line for member in _gzip_members(f) for line in member.splitlines())
+        else:
+            lines = iter(f)
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def _request_body(entry: Dict) -> bytes:
+    if "body" in entry:
+        return json.dumps(entry["body"]).encode("utf-8")
+    if "body_rows" in entry:
+        return "".join(json.dumps(row) + "\n" for row in entry["body_rows"]).encode("utf-8")
+    return base64.b64decode(entry.get("body_b64", ""))
+
+
+# ============================================================
+# REPLAY
+# ============================================================
+
+def _percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class ReplayRun:
+    """Rejoue une capture et collecte latences, erreurs et profondeur de file"""
+
+    def __init__(self, target: str, speed: Optional[float] = 1.0, concurrency: int = 32,
+                 timeout: float = 120, health_interval: float = 0.5):
+        self.target = target.rstrip("/")
+        self.speed = speed  # None = vitesse max (pas d'attente)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.health_interval = health_interval
+        self.results: List[Dict] = []
+        self.backlog_samples: List[int] = []
+        self.server_samples: List[int] = []
+        self._submitted = 0
+        self._started = 0
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        self._session.mount("http://", HTTPAdapter(pool_maxsize=concurrency))
+        self._session.mount("https://", HTTPAdapter(pool_maxsize=concurrency))
+
+    def _send(self, entry: Dict):
+        with self._lock:
+            self._started += 1
+
+        headers = {"Content-Type": entry.get("content_type", "application/json")}
+        if entry.get("content_encoding"):
+            headers["Content-Encoding"] = entry["content_encoding"]
+
+        result = {"path": entry["path"], "status": None, "error": None}
+        start = time.perf_counter()
+        try:
+            response = self._session.post(f"{self.target}{entry['path']}", data=_request_body(entry),
+                                          headers=headers, timeout=self.timeout)
+            result["status"] = response.status_code
+        except requests.RequestException as e:
+            result["error"] = type(e).__name__
+        result["latency"] = time.perf_counter() - start
+
+        with self._lock:
+            self.results.append(result)
+
+    def _sample_queue(self, stop: threading.Event):
+        """Échantillonne la file côté client et les requêtes en cours côté serveur"""
+        while not stop.wait(self.health_interval):
+            with self._lock:
+                self.backlog_samples.append(self._submitted - self._started)
+            try:
+                health = self._session.get(f"{self.target}/health", timeout=2).json()
+                self.server_samples.append(int(health.get("in_flight", 0)))
+            except (requests.RequestException, ValueError):
+                pass
+
+    def run(self, entries: Iterable[Dict]) -> Dict:
+        stop = threading.Event()
+        sampler = threading.Thread(target=self._sample_queue, args=(stop,), daemon=True)
+        sampler.start()
+
+        first_ts = None
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for entry in entries:
+                if self.speed:
+                    first_ts = entry["ts"] if first_ts is None else first_ts
+                    delay = (entry["ts"] - first_ts) / self.speed - (time.perf_counter() - start)
+                    if delay > 0:
+                        time.sleep(delay)
+                with self._lock:
+                    self._submitted += 1
+                pool.submit(self._send, entry)
+        duration = time.perf_counter() - start
+
+        stop.set()
+        sampler.join()
+        return self.report(duration)
+
+    def report(self, duration: float) -> Dict:
+        def latency_stats(results: List[Dict]) -> Dict:
+            latencies = sorted(r["latency"] * 1000 for r in results)
+            errors = [r for r in results if r["error"] or (r["status"] or 0) >= 400]
+            return {
+                "requests": len(results),
+                "error_rate": round(len(errors) / len(results), 4) if results else 0.0,
+                "latency_ms": {
+                    "p50": _percentile(latencies, 50),
+                    "p90": _percentile(latencies, 90),
+                    "p99": _percentile(latencies, 99),
+                    "max": latencies[-1] if latencies else None
+                }
+            }
+
+        statuses: Dict[str, int] = {}
+        for r in self.results:
+            key = r["error"] or str(r["status"])
+            statuses[key] = statuses.get(key, 0) + 1
+
+        report = {
+            "target": self.target,
+            "speed": f"{self.speed}x" if self.speed else "max",
+            "concurrency": self.concurrency,
+            "duration_s": round(duration, 3),
+            "throughput_rps": round(len(self.results) / duration, 2) if duration else None,
+            **latency_stats(self.results),
+            "statuses": statuses,
+            "queue_depth": {
+                "client_backlog_max": max(self.backlog_samples, default=0),
+                "client_backlog_mean": round(sum(self.backlog_samples) / len(self.backlog_samples), 2)
+                if self.backlog_samples else 0,
+                "server_in_flight_max": max(self.server_samples, default=0),
+                "server_in_flight_mean": round(sum(self.server_samples) / len(self.server_samples), 2)
+                if self.server_samples else 0
+            },
+            "by_path": {}
+        }
+        for path in sorted({r["path"] for r in self.results}):
+            report["by_path"][path] = latency_stats([r for r in self.results if r["path"] == path])
+
+        for stats in [report, *report["by_path"].values()]:
+            stats["latency_ms"] = {k: round(v, 2) if v is not None else None
+                                   for k, v in stats["latency_ms"].items()}
+        return report
+
+
+def print_report(report: Dict):
+    print("=" * 60)
+    print(f"REPLAY {report['target']} @ {report['speed']} (concurrency {report['concurrency']})")
+    print("=" * 60)
+    print(f"Requests:    {report['requests']} in {report['duration_s']}s "
+          f"({report['throughput_rps']} req/s)")
+    print(f"Error rate:  {report['error_rate'] * 100:.2f}%  {report['statuses']}")
+    latency = report["latency_ms"]
+    print(f"Latency ms:  p50={latency['p50']} p90={latency['p90']} p99={latency['p99']} max={latency['max']}")
+    queue = report["queue_depth"]
+    print(f"Queue depth: client backlog max={queue['client_backlog_max']} mean={queue['client_backlog_mean']}, "
+          f"server in-flight max={queue['server_in_flight_max']} mean={queue['server_in_flight_mean']}")
+    for path, stats in report["by_path"].items():
+        latency = stats["latency_ms"]
+        print(f"  {path}: {stats['requests']} req, errors {stats['error_rate'] * 100:.2f}%, "
+              f"p50={latency['p50']} p99={latency['p99']}")
+
+
+# ============================================================
+# MAIN
+# ============================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured Velociraptor webhook traffic")
+    parser.add_argument("capture", help="Capture file (.jsonl.gz) written with CAPTURE_FILE")
+    parser.add_argument("--target", default="http://localhost:5000", help="Webhook server base URL")
+    parser.add_argument("--speed", default="1", help="Replay speed: 1, N (e.g. 10) or 'max'")
+    parser.add_argument("--concurrency", type=int, default=32, help="Max in-flight requests")
+    parser.add_argument("--paths", default=",".join(CAPTURED_PATHS), help="Comma-separated paths to replay")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    speed = None if args.speed.lower() == "max" else float(args.speed.rstrip("x"))
+    paths = set(args.paths.split(","))
+    entries = (e for e in load_capture(args.capture) if e["path"] in paths)
+
+    report = ReplayRun(args.target, speed=speed, concurrency=args.concurrency).run(entries)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
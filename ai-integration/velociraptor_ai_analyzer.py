@@ -11,10 +11,14 @@ Repository: github.com/Help4Info/velociraptor-dfir-guide
 
 import os
 import json
+import heapq
+import bisect
+import hashlib
+from collections import OrderedDict
 import requests
 import time
-from datetime import datetime
-from typing import Dict, List, Optional
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
 from dataclasses import dataclass
 from enum import Enum
 
@@ -45,6 +49,19 @@ class Config:
     auto_response_enabled: bool = False
     severity_threshold: int = 7  # 1-10
 
+    # Timeline (contexte fenêtré par hôte)
+    timeline_window_minutes: int = 15
+    timeline_max_events: int = 500
+    timeline_max_hosts: int = 10000
+
+    # Modèle local (court-circuite le LLM si confiant, nécessite numpy)
+    local_model_enabled: bool = False
+    local_model_confidence: float = 0.9
+    local_model_min_samples: int = 50
+    local_model_store: str = "~/.velociraptor-ai/verdicts.jsonl"  # features hashées, pas d'artefact
+    local_model_store_max_records: int = 10000
+    local_model_audit_rate: float = 0.05
+
 config = Config()
 
 # ============================================================
@@ -325,6 +342,161 @@ class AutoResponseEngine:
         return True
 
 
+# ============================================================
+# INCREMENTAL TIMELINE
+# ============================================================
+
+# Champs conservés dans la timeline compacte envoyée à l'AI
+TIMELINE_FIELDS = ("EventID", "ScriptBlockText", "CommandLine", "Image", "path", "hash", "DestinationIp")
+TIMELINE_TEXT_LIMIT = 300
+
+
+def parse_timestamp(value) -> Optional[datetime]:
+    """Convertit un TimeCreated Velociraptor (ISO 8601 ou epoch) en datetime UTC"""
+    if value is None:
+        return None
+    try:
+        if isinstance(value, (int, float)):
+            return datetime.fromtimestamp(value, tz=timezone.utc)
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except (ValueError, OverflowError, OSError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+class HostTimeline:
+    """Fenêtre glissante triée des événements d'un hôte, tous artefacts confondus"""
+
+    def __init__(self, window: timedelta, max_events: int):
+        self.window = window
+        self.max_events = max_events
+        self.last_ingest = time.monotonic()
+        self._times: List[datetime] = []
+        self._events: List[Tuple[datetime, int, bytes, Dict]] = []
+        self._seen = set()
+        self._seq = 0
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    @staticmethod
+    def event_keys(artifact: Dict) -> Iterable[Tuple[datetime, bytes, Dict]]:
+        """(TimeCreated, clé de dédoublonnage compacte, événement) d'un artefact"""
+        source = artifact.get("source", "unknown")
+        fallback = parse_timestamp(artifact.get("timestamp"))
+
+        for event in artifact.get("events", []):
+            ts = parse_timestamp(event.get("TimeCreated")) or fallback
+            if ts is None:
+                continue
+            raw = f"{source}|{ts.isoformat()}|{json.dumps(event, sort_keys=True, default=str)}"
+            yield ts, hashlib.blake2b(raw.encode("utf-8"), digest_size=16).digest(), event
+
+    def _stream(self, artifact: Dict) -> List[Tuple[datetime, int, bytes, Dict]]:
+        """Événements datés et dédoublonnés d'un artefact, triés par TimeCreated"""
+        source = artifact.get("source", "unknown")
+        stream = []
+
+        for ts, key, event in self.event_keys(artifact):
+            if key in self._seen:
+                continue
+            self._seen.add(key)
+            self._seq += 1
+            stream.append((ts, self._seq, key, {"source": source, **event}))
+
+        stream.sort(key=lambda item: item[:2])
+        return stream
+
+    def merge(self, artifacts: Iterable[Dict]):
+        """k-way merge des artefacts dans la fenêtre existante, puis éviction"""
+        self.last_ingest = time.monotonic()
+        streams = [self._stream(artifact) for artifact in artifacts]
+        merged = list(heapq.merge(self._events, *streams, key=lambda item: item[:2]))
+        if not merged:
+            return
+
+        horizon = merged[-1][0] - self.window
+        start = max(bisect.bisect_left([item[0] for item in merged], horizon),
+                    len(merged) - self.max_events)
+        for _, _, key, _ in merged[:start]:
+            self._seen.discard(key)
+
+        self._events = merged[start:]
+        self._times = [item[0] for item in self._events]
+
+    def context(self, start: datetime, end: datetime, exclude: frozenset = frozenset()) -> List[Dict]:
+        """Timeline compacte des événements entre start - window et end + window"""
+        lo = bisect.bisect_left(self._times, start - self.window)
+        hi = bisect.bisect_right(self._times, end + self.window)
+        return [self._compact(ts, event) for ts, _, key, event in self._events[lo:hi] if key not in exclude]
+
+    @staticmethod
+    def _compact(ts: datetime, event: Dict) -> Dict:
+        entry = {"TimeCreated": ts.isoformat().replace("+00:00", "Z"), "source": event["source"]}
+        for field in TIMELINE_FIELDS:
+            if field in event:
+                value = event[field]
+                if isinstance(value, str) and len(value) > TIMELINE_TEXT_LIMIT:
+                    value = value[:TIMELINE_TEXT_LIMIT] + "..."
+                entry[field] = value
+        return entry
+
+
+class TimelineEngine:
+    """Construit incrémentalement une timeline par hôte à partir des artefacts"""
+
+    def __init__(self, window_minutes: int = 15, max_events: int = 500, max_hosts: int = 10000):
+        self.window = timedelta(minutes=window_minutes)
+        self.max_events = max_events
+        self.max_hosts = max_hosts
+        # Ordre LRU: l'hôte le moins récemment alimenté en tête
+        self.hosts: "OrderedDict[str, HostTimeline]" = OrderedDict()
+
+    @staticmethod
+    def host_key(artifact: Dict, client_id: str = None) -> str:
+        return client_id or artifact.get("client_id") or artifact.get("hostname") or "unknown"
+
+    def ingest(self, artifacts: Iterable[Dict], client_id: str = None):
+        """Ajoute un lot d'artefacts (éventuellement multi-hôtes) aux timelines"""
+        by_host: Dict[str, List[Dict]] = {}
+        for artifact in artifacts:
+            by_host.setdefault(self.host_key(artifact, client_id), []).append(artifact)
+
+        for host, host_artifacts in by_host.items():
+            timeline = self.hosts.get(host)
+            if timeline is None:
+                timeline = self.hosts[host] = HostTimeline(self.window, self.max_events)
+            self.hosts.move_to_end(host)
+            timeline.merge(host_artifacts)
+
+        self._evict()
+
+    def _evict(self):
+        """Oublie les hôtes inactifs depuis plus d'une fenêtre, et au-delà de max_hosts"""
+        idle_before = time.monotonic() - self.window.total_seconds()
+        while self.hosts:
+            host, timeline = next(iter(self.hosts.items()))
+            if len(self.hosts) <= self.max_hosts and timeline.last_ingest >= idle_before:
+                break
+            del self.hosts[host]
+
+    def context_for(self, artifact: Dict, client_id: str = None) -> List[Dict]:
+        """Timeline des N minutes autour des événements de l'artefact, sans ses propres événements"""
+        timeline = self.hosts.get(self.host_key(artifact, client_id))
+        if timeline is None:
+            return []
+
+        times = [parse_timestamp(e.get("TimeCreated")) for e in artifact.get("events", [])]
+        times = [t for t in times if t] or [parse_timestamp(artifact.get("timestamp"))]
+        times = [t for t in times if t]
+        if not times:
+            return []
+        own = frozenset(key for _, key, _ in HostTimeline.event_keys(artifact))
+        return timeline.context(min(times), max(times), own)
+
+
 # ============================================================
 # MAIN ANALYZER PIPELINE
 # ============================================================
@@ -337,8 +509,25 @@ class DFIRPipeline:
         self.analyzer = self._init_analyzer()
         self.velociraptor = VelociraptorClient(config.velociraptor_url)
         self.auto_response = AutoResponseEngine(self.velociraptor)
+        self.timeline = TimelineEngine(config.timeline_window_minutes, config.timeline_max_events,
+                                       config.timeline_max_hosts)
 
     def _init_analyzer(self) -> AIAnalyzer:
+        """Initialise l'analyseur AI, précédé du modèle local si activé"""
+        analyzer = self._init_provider()
+        if config.local_model_enabled:
+            from severity_model import LearnedSeverityAnalyzer
+            analyzer = LearnedSeverityAnalyzer(
+                analyzer,
+                confidence=config.local_model_confidence,
+                min_samples=config.local_model_min_samples,
+                store_path=config.local_model_store,
+                audit_rate=config.local_model_audit_rate,
+                store_max_records=config.local_model_store_max_records
+            )
+        return analyzer
+
+    def _init_provider(self) -> AIAnalyzer:
         """Initialise l'analyseur AI approprié"""
         if self.ai_provider == AIProvider.GEMINI:
             return GeminiAnalyzer(config.gemini_api_key)
@@ -357,10 +546,16 @@ class DFIRPipeline:
         print(f"[PIPELINE] Analyzing artifact with {self.ai_provider.value}...")
         start_time = time.time()
 
+        # Contexte temporel: événements des autres artefacts du même hôte
+        self.timeline.ingest([artifact_data], client_id)
+        timeline = self.timeline_context(artifact_data, client_id)
+        if timeline:
+            artifact_data = {**artifact_data, "timeline": timeline}
+
         # Analyse AI
         analysis = self.analyzer.analyze(artifact_data)
         analysis["analysis_time"] = time.time() - start_time
-        analysis["ai_provider"] = self.ai_provider.value
+        analysis["ai_provider"] = "local" if analysis.get("model") == "local" else self.ai_provider.value
 
         print(f"[PIPELINE] Analysis complete in {analysis['analysis_time']:.2f}s")
         print(f"[PIPELINE] Severity: {analysis.get('severity', 'N/A')}")
@@ -371,8 +566,19 @@ class DFIRPipeline:
             response = self.auto_response.execute_response(client_id, analysis)
             analysis["auto_response_result"] = response
 
+        if timeline:
+            analysis["timeline_events"] = len(timeline)
+
         return analysis
 
+    def timeline_context(self, artifact_data: Dict, client_id: str = None) -> List[Dict]:
+        """Timeline compacte des autres artefacts du même hôte (vide si aucun)"""
+        return self.timeline.context_for(artifact_data, client_id)
+
+    def ingest_artifacts(self, artifacts: List[Dict], client_id: str = None):
+        """Alimente la timeline sans analyse (ex: artefacts de contexte d'un hunt)"""
+        self.timeline.ingest(artifacts, client_id)
+
     def process_hunt_results(self, hunt_id: str) -> List[Dict]:
         """Traite tous les résultats d'un hunt"""
         # Implémenter le traitement batch des résultats
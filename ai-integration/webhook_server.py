@@ -10,15 +10,35 @@ Installation:
 Lancement:
     python webhook_server.py
 
+Mode shardé (affinité client sur N processus):
+    SHARD_WORKERS=4 python webhook_server.py
+
+Le webhook accepte des corps JSON ou NDJSON, compressés gzip/zstd
+(Content-Encoding), lus en streaming avec des limites de taille.
+
+Capture / replay du trafic (voir traffic_replay.py):
+    CAPTURE_FILE=capture.jsonl.gz python webhook_server.py
+    AI_PROVIDER_STUB=1 python webhook_server.py
+
 Author: Help4Info
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 import os
 import json
+import time
+import atexit
+import hashlib
+import threading
 import requests
+from collections import OrderedDict
 from datetime import datetime
 
+from shard_dispatcher import ShardedDispatcher
+from stream_ingest import (PayloadTooLarge, RowStreamParser, UnsupportedEncoding,
+                           decoded_chunks, is_ndjson, preview_json, read_document)
+from traffic_replay import CAPTURED_PATHS, TrafficRecorder
+
 app = Flask(__name__)
 
 # ============================================================
@@ -34,6 +54,40 @@ TEAMS_WEBHOOK_URL = os.getenv("TEAMS_WEBHOOK_URL", "")
 
 SEVERITY_THRESHOLD = 7  # Alerte si >= 7
 
+# Ingestion en streaming (octets)
+WEBHOOK_MAX_BYTES = int(os.getenv("WEBHOOK_MAX_BYTES", str(256 * 1024 * 1024)))  # corps brut
+WEBHOOK_MAX_DECODED_BYTES = int(os.getenv("WEBHOOK_MAX_DECODED_BYTES", str(1024 * 1024 * 1024)))
+WEBHOOK_MAX_ROW_BYTES = int(os.getenv("WEBHOOK_MAX_ROW_BYTES", str(1024 * 1024)))  # une ligne
+WEBHOOK_BATCH_ROWS = int(os.getenv("WEBHOOK_BATCH_ROWS", "500"))  # lignes par analyse AI
+WEBHOOK_BATCH_BYTES = int(os.getenv("WEBHOOK_BATCH_BYTES", str(256 * 1024)))  # JSON par analyse AI
+WEBHOOK_MAX_BATCHES = int(os.getenv("WEBHOOK_MAX_BATCHES", "8"))  # analyses AI par requête
+ANALYZE_MAX_BYTES = int(os.getenv("ANALYZE_MAX_BYTES", str(16 * 1024 * 1024)))  # /analyze
+LOG_PREVIEW_CHARS = 500
+
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "0"))  # 0 = mode mono-processus
+SHARD_THREADS = int(os.getenv("SHARD_THREADS", "16"))  # analyses simultanées par worker
+SHARD_TIMEOUT = int(os.getenv("SHARD_TIMEOUT", "120"))  # secondes
+SHARD_DEDUP_TTL = int(os.getenv("SHARD_DEDUP_TTL", "300"))  # secondes, 0 = désactivé
+SHARD_DEDUP_SIZE = 32  # verdicts récents conservés par client
+_shard_state_lock = threading.Lock()  # état des clients, dans chaque worker shardé
+
+dispatcher = None  # ShardedDispatcher, créé à la première requête (voir get_dispatcher)
+
+CAPTURE_FILE = os.getenv("CAPTURE_FILE", "")  # ex: capture.jsonl.gz
+CAPTURE_REDACT = os.getenv("CAPTURE_REDACT", "").split(",")  # clés à masquer
+CAPTURE_MAX_BYTES = int(os.getenv("CAPTURE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# Fournisseurs stubs (replay/benchmark sans appel aux APIs AI)
+AI_PROVIDER_STUB = os.getenv("AI_PROVIDER_STUB", "") == "1"
+STUB_LATENCY_MS = int(os.getenv("STUB_LATENCY_MS", "200"))
+
+recorder = None  # TrafficRecorder, créé à la première requête (voir get_recorder)
+_init_lock = threading.Lock()
+
+# Requêtes en cours de traitement (profondeur de file exposée par /health)
+in_flight = 0
+in_flight_lock = threading.Lock()
+
 # ============================================================
 # AI ANALYSIS FUNCTIONS
 # ============================================================
@@ -216,6 +270,175 @@ def execute_auto_response(analysis: dict, client_id: str = None):
     return response_log
 
 
+# ============================================================
+# SHARDED EXECUTION
+# ============================================================
+
+def analyze_with_stub(data: dict) -> dict:
+    """Fournisseur factice: latence simulée, verdict constant"""
+    time.sleep(STUB_LATENCY_MS / 1000)
+    return {
+        "severity": 5,
+        "summary": "Stub analysis",
+        "mitre_techniques": [],
+        "iocs": [],
+        "recommendations": [],
+        "auto_response": "NONE",
+        "threat_type": "stub",
+        "confidence": 0
+    }
+
+
+def run_analysis(provider: str, artifact_data: dict) -> dict:
+    """Analyse AI selon le fournisseur demandé"""
+    if AI_PROVIDER_STUB:
+        return analyze_with_stub(artifact_data)
+    if provider == "gemini":
+        return analyze_with_gemini(artifact_data)
+    elif provider == "openai":
+        return analyze_with_openai(artifact_data)
+    raise ValueError(f"Unknown provider: {provider}")
+
+
+def shard_handler(client_id: str, job: dict, state: dict) -> dict:
+    """Exécuté dans le worker propriétaire du client (état local par client)
+
+    Tous les jobs d'un client arrivant sur le même worker, `state` sert de
+    cache de verdicts récents: un artefact identique renvoyé par le même
+    client (retry Velociraptor, collecte répétée) dans les SHARD_DEDUP_TTL
+    secondes réutilise l'analyse précédente au lieu de rappeler le LLM.
+    Les jobs d'un client pouvant être concurrents, le cache est protégé par
+    un verrou qui n'est pas tenu pendant l'analyse.
+    """
+    if not client_id or SHARD_DEDUP_TTL <= 0:
+        return run_analysis(job["provider"], job["data"])
+
+    key = hashlib.blake2b(
+        json.dumps([job["provider"], job["data"]], sort_keys=True, default=str).encode("utf-8"),
+        digest_size=16
+    ).digest()
+    now = time.monotonic()
+    with _shard_state_lock:
+        recent = state.setdefault("recent", OrderedDict())
+        cached = recent.get(key)
+        if cached and now - cached[0] < SHARD_DEDUP_TTL:
+            state["dedup_hits"] = state.get("dedup_hits", 0) + 1
+            return {**cached[1], "cached": True}
+
+    analysis = run_analysis(job["provider"], job["data"])
+    if "error" not in analysis:
+        with _shard_state_lock:
+            recent[key] = (now, analysis)
+            recent.move_to_end(key)
+            while len(recent) > SHARD_DEDUP_SIZE:
+                recent.popitem(last=False)
+    return analysis
+
+
+def get_dispatcher():
+    """Dispatcher créé paresseusement, dans le processus qui sert les requêtes
+
+    Fonctionne donc aussi sous `flask run` ou gunicorn. Avec gunicorn, lancer
+    un seul worker (ex: `gunicorn -w 1 --threads 16 webhook_server:app`):
+    chaque worker gunicorn aurait sinon son propre anneau, et l'affinité
+    client ne serait plus garantie. Les workers shardés réimportent ce
+    module: rien ne doit donc démarrer au moment de l'import.
+    """
+    global dispatcher
+    if SHARD_WORKERS <= 0:
+        return None
+    with _init_lock:
+        if dispatcher is None:
+            dispatcher = ShardedDispatcher(shard_handler, workers=SHARD_WORKERS, threads=SHARD_THREADS)
+            dispatcher.start()
+    return dispatcher
+
+
+def dispatch_analysis(provider: str, artifact_data: dict, client_id: str = None) -> dict:
+    """Analyse en local ou sur le worker du client si le mode shardé est actif
+
+    Comme les fournisseurs, renvoie {"error": ...} en cas d'échec (worker
+    mort, exception du handler, délai dépassé) au lieu de lever.
+    """
+    shards = get_dispatcher()
+    if shards is None:
+        return run_analysis(provider, artifact_data)
+    try:
+        future = shards.submit(client_id, {"provider": provider, "data": artifact_data})
+        return future.result(timeout=SHARD_TIMEOUT)
+    except TimeoutError:
+        return {"error": f"Shard timeout after {SHARD_TIMEOUT}s"}
+    except Exception as e:
+        return {"error": str(e)}
+
+
+# ============================================================
+# STREAMING INGESTION
+# ============================================================
+
+def request_chunks(max_bytes: int, max_decoded_bytes: int = None):
+    """Corps de la requête décompressé à la volée, sans le charger en mémoire"""
+    if request.content_length is not None and request.content_length > max_bytes:
+        raise PayloadTooLarge(f"Request body exceeds {max_bytes} bytes")
+    return decoded_chunks(request.stream, request.headers.get("Content-Encoding"),
+                          max_bytes, max_decoded_bytes, tee=g.get("capture"))
+
+
+def read_json_request(max_bytes: int = ANALYZE_MAX_BYTES):
+    """Remplace request.json: corps JSON borné, gzip/zstd acceptés"""
+    return read_document(request_chunks(max_bytes), max_bytes)
+
+
+@app.errorhandler(PayloadTooLarge)
+def payload_too_large(e):
+    return jsonify({"error": str(e)}), 413
+
+
+@app.errorhandler(UnsupportedEncoding)
+def unsupported_encoding(e):
+    return jsonify({"error": str(e)}), 415
+
+
+# ============================================================
+# CAPTURE & METRICS
+# ============================================================
+
+def get_recorder():
+    """Capture ouverte paresseusement (les workers shardés importent ce module)"""
+    global recorder
+    if CAPTURE_FILE:
+        with _init_lock:
+            if recorder is None:
+                recorder = TrafficRecorder(CAPTURE_FILE, CAPTURE_REDACT, CAPTURE_MAX_BYTES)
+                atexit.register(recorder.close)
+    return recorder
+
+
+@app.before_request
+def track_request():
+    """Compte les requêtes en cours et prépare la capture du trafic"""
+    global in_flight
+    if request.path not in CAPTURED_PATHS:
+        return
+
+    with in_flight_lock:
+        in_flight += 1
+    if get_recorder():
+        g.capture = recorder.begin(request.path, request.content_type,
+                                   request.headers.get("Content-Encoding"))
+
+
+@app.teardown_request
+def untrack_request(exc=None):
+    global in_flight
+    if request.path in CAPTURED_PATHS:
+        with in_flight_lock:
+            in_flight -= 1
+    capture = g.pop("capture", None)
+    if capture is not None:
+        recorder.finish(capture)
+
+
 # ============================================================
 # API ENDPOINTS
 # ============================================================
@@ -223,29 +446,35 @@ def execute_auto_response(analysis: dict, client_id: str = None):
 @app.route("/health", methods=["GET"])
 def health_check():
     """Health check endpoint"""
-    return jsonify({"status": "healthy", "timestamp": datetime.now().isoformat()})
+    return jsonify({
+        "status": "healthy",
+        "timestamp": datetime.now().isoformat(),
+        "in_flight": in_flight,
+        "shard_pending": dispatcher.stats()["pending"] if dispatcher else 0
+    })
 
 
 @app.route("/analyze", methods=["POST"])
 def analyze_endpoint():
     """Endpoint principal pour l'analyse AI"""
-    data = request.json
+    try:
+        data = read_json_request()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    if not data:
+    if not isinstance(data, dict) or not data:
         return jsonify({"error": "No data provided"}), 400
 
     provider = data.get("provider", DEFAULT_PROVIDER)
     client_id = data.get("client_id")
     artifact_data = data.get("data", data)
 
-    # Analyse AI
-    if provider == "gemini":
-        analysis = analyze_with_gemini(artifact_data)
-    elif provider == "openai":
-        analysis = analyze_with_openai(artifact_data)
-    else:
+    if provider not in ("gemini", "openai"):
         return jsonify({"error": f"Unknown provider: {provider}"}), 400
 
+    # Analyse AI
+    analysis = dispatch_analysis(provider, artifact_data, client_id)
+
     # Ajouter métadonnées
     analysis["analyzed_at"] = datetime.now().isoformat()
     analysis["provider"] = provider
@@ -264,18 +493,88 @@ def analyze_endpoint():
 
 @app.route("/webhook/velociraptor", methods=["POST"])
 def velociraptor_webhook():
-    """Webhook pour recevoir les événements Velociraptor"""
-    data = request.json
+    """Webhook pour recevoir les événements Velociraptor
+
+    Le corps est lu ligne par ligne: les tableaux (JSON) ou les lignes
+    (NDJSON) sont analysés par lots de WEBHOOK_BATCH_ROWS lignes et
+    WEBHOOK_BATCH_BYTES octets au plus, de sorte que la mémoire par requête
+    reste constante quelle que soit la taille du payload. Au-delà de
+    WEBHOOK_MAX_BATCHES lots, les lignes sont comptées mais plus analysées.
+
+    Le client_id (routage vers le worker shardé) est lu dans la query string,
+    l'en-tête X-Client-Id, ou à défaut dans les membres du corps lus avant le
+    premier lot: il est figé à ce moment, pour que tous les lots d'une requête
+    aillent au même worker. Les autres membres de l'en-tête placés après les
+    tableaux ne sont joints qu'aux lots suivants: Velociraptor doit donc
+    envoyer les métadonnées (hostname, client_id...) en premier.
+    """
+    parser = RowStreamParser(
+        request_chunks(WEBHOOK_MAX_BYTES, WEBHOOK_MAX_DECODED_BYTES),
+        max_row_bytes=WEBHOOK_MAX_ROW_BYTES,
+        split_object=not is_ndjson(request.content_type)
+    )
+    can_analyze = bool(GEMINI_API_KEY or AI_PROVIDER_STUB)
 
     print(f"[WEBHOOK] Received data from Velociraptor")
-    print(json.dumps(data, indent=2, default=str)[:500])
 
-    # Analyser automatiquement
-    analysis = analyze_with_gemini(data) if GEMINI_API_KEY else {"error": "No API key"}
+    analyses = []
+    batch = {}
+    batch_rows = 0
+    batch_bytes = 0
+    total_rows = 0
+    skipped_rows = 0
+    client_id = request.args.get("client_id") or request.headers.get("X-Client-Id")
+
+    def flush():
+        nonlocal batch, batch_rows, batch_bytes, skipped_rows, client_id
+        if client_id is None:
+            client_id = parser.header.get("client_id") or ""
+        if can_analyze and len(analyses) < WEBHOOK_MAX_BATCHES:
+            analyses.append(dispatch_analysis("gemini", {**parser.header, **batch}, client_id))
+        else:
+            skipped_rows += batch_rows
+        batch, batch_rows, batch_bytes = {}, 0, 0
+
+    try:
+        for field, row in parser.rows():
+            if total_rows == 0:
+                print(preview_json(row, LOG_PREVIEW_CHARS))
+            if batch_rows and batch_bytes + parser.row_size > WEBHOOK_BATCH_BYTES:
+                flush()
+            batch.setdefault(field or "rows", []).append(row)
+            batch_rows += 1
+            batch_bytes += parser.row_size
+            total_rows += 1
+            if batch_rows >= WEBHOOK_BATCH_ROWS:
+                flush()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if total_rows == 0 and not parser.header:
+        return jsonify({"error": "No data provided"}), 400
+
+    # Dernier lot, ou payload sans tableau (en-tête seul)
+    if batch_rows or total_rows == 0:
+        if total_rows == 0:
+            print(preview_json(parser.header, LOG_PREVIEW_CHARS))
+        flush()
 
+    print(f"[WEBHOOK] {total_rows} rows, {len(analyses)} analyses, {skipped_rows} rows not analyzed")
+
+    if not can_analyze:
+        return jsonify({"received": True, "rows": total_rows, "analysis": {"error": "No API key"}})
+
+    # Le lot le plus sévère résume la requête; les autres lots en résumé seulement
     return jsonify({
         "received": True,
-        "analysis": analysis
+        "rows": total_rows,
+        "skipped_rows": skipped_rows,
+        "analysis": max(analyses, key=lambda a: a.get("severity", 0)),
+        "batches": [
+            {key: analysis.get(key) for key in ("severity", "auto_response", "threat_type", "error")
+             if key in analysis}
+            for analysis in analyses
+        ]
     })
 
 
@@ -304,6 +603,30 @@ def generate_report():
     return jsonify(report)
 
 
+@app.route("/shards", methods=["GET"])
+def shards_status():
+    """État du mode shardé (répartition des clients par worker)"""
+    shards = get_dispatcher()
+    if shards is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **shards.stats()})
+
+
+@app.route("/shards/resize", methods=["POST"])
+def shards_resize():
+    """Change le nombre de workers et rééquilibre l'anneau de hachage"""
+    shards = get_dispatcher()
+    if shards is None:
+        return jsonify({"error": "Sharded mode disabled (SHARD_WORKERS=0)"}), 400
+
+    workers = (request.json or {}).get("workers")
+    if not isinstance(workers, int) or workers < 1:
+        return jsonify({"error": "workers must be a positive integer"}), 400
+
+    shards.resize(workers)
+    return jsonify({"enabled": True, **shards.stats()})
+
+
 # ============================================================
 # MAIN
 # ============================================================
@@ -318,6 +641,10 @@ if __name__ == "__main__":
     print(f"Slack Webhook: {'✓' if SLACK_WEBHOOK_URL else '✗'}")
     print(f"Teams Webhook: {'✓' if TEAMS_WEBHOOK_URL else '✗'}")
     print(f"Severity Threshold: {SEVERITY_THRESHOLD}")
+    print(f"Shard Workers: {SHARD_WORKERS or 'disabled'}")
+    print(f"Capture File: {CAPTURE_FILE or 'disabled'}")
+    print(f"Stub Providers: {'✓' if AI_PROVIDER_STUB else '✗'}")
     print("="*60)
 
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    # Le reloader Flask relancerait le processus et dupliquerait les workers
+    app.run(host="0.0.0.0", port=5000, debug=True, use_reloader=SHARD_WORKERS == 0)